@@ -1,26 +1,114 @@
 from __future__ import print_function
 import argparse
+import copy
 import sys
 import os
 import logging
-import yaml
 
+try:
+    from sys import intern
+except ImportError:  # Python 2, intern is a builtin
+    pass
 
 log = logging.getLogger(__name__)
 
+# yaml module and its loader, imported on first use
+_YAML = None
+_YAML_LOADER = None
 
-def _deep_update(in_dict, _update):
+# Parsed YAML default configuration files, keyed by absolute path,
+# along with the file stamp they were parsed from
+_CONF_CACHE = {}
+
+
+def _deep_update(in_dict, _update, track=None):
     """
         Recursively update a dict with another, returns the result
+
+        Sub-dicts of _update missing from in_dict are moved as is, not copied.
+        If track is a set, argument strings of updated values are added to it
     """
-    for key, val in _update.items():
-        if isinstance(val, dict):
-            in_dict[key] = _deep_update(in_dict.get(key, {}), val)
-        else:
-            in_dict[key] = val
+    stack = [("", in_dict, _update)]
+    while stack:
+        prefix, dst, src = stack.pop()
+        for key, val in src.items():
+            if isinstance(val, dict) and isinstance(dst.get(key), dict):
+                stack.append((prefix + str(key) + "-", dst[key], val))
+            else:
+                dst[key] = val
+                if track is None:
+                    continue
+                if isinstance(val, dict):
+                    sub_prefix = prefix + str(key) + "-"
+                    track.update(
+                        sub_prefix + "-".join(str(k) for k in path)
+                        for path, _ in _dict_to_paths(val)
+                    )
+                else:
+                    track.add(prefix + str(key))
     return in_dict
 
 
+def _yaml_load(stream):
+    """
+        Parse YAML content, with libyaml C loader if available
+    """
+    global _YAML, _YAML_LOADER
+    if _YAML is None:
+        import yaml
+
+        _YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        _YAML = yaml
+    return _YAML.load(stream, Loader=_YAML_LOADER)
+
+
+def _load_conf_file(path):
+    """
+        Parse a YAML configuration file, reusing the previous result
+        if the file did not change since last call
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (
+        st.st_dev,
+        st.st_ino,
+        st.st_size,
+        getattr(st, "st_mtime_ns", st.st_mtime),
+    )
+    cached = _CONF_CACHE.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, "rb") as conf_file:
+            cached = (stamp, _intern_keys(_yaml_load(conf_file.read())))
+        # Only the last version of a file is kept
+        _CONF_CACHE[path] = cached
+    return copy.deepcopy(cached[1])
+
+
+def _intern_keys(in_dict):
+    """
+        Recursively intern dict string keys, returns the result
+        (anything else than a dict is returned as is)
+    """
+    if not isinstance(in_dict, dict):
+        return in_dict
+    return {
+        intern(key) if isinstance(key, str) else key: _intern_keys(val)
+        for key, val in in_dict.items()
+    }
+
+
+def _deep_key_find(in_dict, sub_str):
+    """
+        Recursively check if any dict key contains a string
+    """
+    for key, val in in_dict.items():
+        if isinstance(key, str) and sub_str in key:
+            return True
+        if isinstance(val, dict) and _deep_key_find(val, sub_str):
+            return True
+    return False
+
+
 def _deep_key_replace(in_dict, old_str, new_str):
     """
         Recursively replace dict keys, returns the result
@@ -28,7 +116,7 @@ def _deep_key_replace(in_dict, old_str, new_str):
     out_dict = {}
     for key, val in in_dict.items():
         if isinstance(key, str):
-            new_key = key.replace(old_str, new_str)
+            new_key = intern(key.replace(old_str, new_str))
         else:
             new_key = key
         if isinstance(val, dict):
@@ -38,49 +126,177 @@ def _deep_key_replace(in_dict, old_str, new_str):
     return out_dict
 
 
-def _dict_to_args(in_dict):
+def _dict_to_paths(in_dict):
     """
-        Convert nested dict keys to argparsable argument strings
+        Walk nested dict down to its leaves,
+        yields (keys path, value) tuples in no particular order
 
         :Example:
-        >>> _dict_to_args({k1: {k2: {k3 : v}}})
-        {"k1-k2-k3": v}
+        >>> list(_dict_to_paths({k1: {k2: {k3 : v}}}))
+        [((k1, k2, k3), v)]
     """
-    args = []
-    for arg, val in in_dict.items():
-        if isinstance(val, dict):
-            args += [
-                (str(arg) + "-" + str(argd), vald) for argd, vald in _dict_to_args(val)
-            ]
-        else:
-            args.append((str(arg), val))
-    return args
+    stack = [((), in_dict)]
+    while stack:
+        prefix, sub_dict = stack.pop()
+        for key, val in sub_dict.items():
+            if isinstance(val, dict):
+                stack.append((prefix + (key,), val))
+            else:
+                yield prefix + (key,), val
+
 
+class ListAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, _yaml_load("[%s]" % values))
 
-def _args_to_dict(in_args):
+
+def _help_message(val, arg, mandatory_opts, desc):
+    """
+        Build argparse help message for an option from its description
     """
-        Convert dict of argparse arguments and values to nested dict
+    helpmsg = "*mandatory*, " if arg in mandatory_opts else ""
+    helpmsg += desc
+    if val:
+        helpmsg += " (%s %s)" % (
+            "e.g.," if arg in mandatory_opts else "default is",
+            val,
+        )
+    return helpmsg
 
-        :Example:
-        >>> _args_to_dict({"k1-k2-k3": v})
-        {k1: {k2: {k3 : v}}}
 
+def _bool_cfg(val, arg, mandatory_opts):
     """
-    out_dict = {}
-    for arg, val in in_args.items():
-        sub_dict_ptr = out_dict
-        for i, key in enumerate(arg.split("-")):
-            sub_dict_ptr[key] = {}
-            if i < len(arg.split("-")) - 1:
-                sub_dict_ptr = sub_dict_ptr[key]
-            else:
-                sub_dict_ptr[key] = val
-    return out_dict
+        argparse parameters for a boolean option, switching its value
+    """
+    pkwargs = {"action": "store_false" if val else "store_true"}
+    desc = 'turn %s "%s"' % ("off" if val else "on", arg)
+    return pkwargs, _help_message(val, arg, mandatory_opts, desc)
 
 
-class ListAction(argparse.Action):
-    def __call__(self, parser, namespace, values, option_string=None):
-        setattr(namespace, self.dest, yaml.safe_load("[" + values + "]"))
+def _list_cfg(val, arg, mandatory_opts):
+    """
+        argparse parameters for a list option, as comma separated elements
+    """
+    pkwargs = {
+        "action": ListAction,
+        "type": str,
+        "metavar": "%s,%s,..." % ((arg[0].upper(),) * 2),
+    }
+    desc = 'set elements of "%s" list, separated by ","' % arg
+    return pkwargs, _help_message(val, arg, mandatory_opts, desc)
+
+
+def _store_cfg(val, arg, mandatory_opts):
+    """
+        argparse parameters for a scalar option, typed as its default value
+    """
+    pkwargs = {"action": "store", "type": str if val is None else type(val)}
+    desc = 'set "%s" value, as %s' % (arg, pkwargs["type"].__name__)
+    return pkwargs, _help_message(val, arg, mandatory_opts, desc)
+
+
+_ACTION_TABLE = {bool: _bool_cfg, list: _list_cfg, tuple: _list_cfg}
+
+
+class _ConfParser(argparse.ArgumentParser):
+    """
+        ArgumentParser able to add many options at once
+    """
+
+    def _bulk_add(self, specs):
+        """
+            Add (option strings, parameters) options, parameters including
+            "action" and "dest". Skips add_argument checks and its help
+            formatter instantiation, which is costly when done for each option
+        """
+        for pargs, pkwargs in specs:
+            action_class = self._pop_action_class(pkwargs)
+            action = action_class(option_strings=pargs, **pkwargs)
+            self._optionals._add_action(action)
+
+
+def _conf_options(conf):
+    """
+        List command line options of a configuration,
+        returns sorted (argument, keys path, value, option strings) tuples
+    """
+    short_args = set()
+    options = []
+    argvals = sorted(
+        (
+            ("-".join(str(key) for key in path), path, val)
+            for path, val in _dict_to_paths(conf)
+        ),
+        key=lambda argval: argval[0],
+    )
+    for arg, path, val in argvals:
+        short = arg[0]
+        pargs = ["--" + arg]
+        if short not in short_args:
+            pargs.append("-" + short)
+            short_args.add(short)
+        options.append((arg, path, val, pargs))
+    return options
+
+
+def _check_options(options):
+    """
+        Raise the argparse.ArgumentError argparse would raise
+        if option strings clash with each other or with help option
+    """
+    option_strings = set(["-h", "--help"])
+    for arg, path, val, pargs in options:
+        conflicts = [pstr for pstr in pargs if pstr in option_strings]
+        if conflicts:
+            raise argparse.ArgumentError(
+                None,
+                "argument %s: conflicting option string%s: %s"
+                % (
+                    "/".join(pargs),
+                    "s" if len(conflicts) > 1 else "",
+                    ", ".join(conflicts),
+                ),
+            )
+        option_strings.update(pargs)
+
+
+def _build_parser(conf, mandatory_opts):
+    """
+        Build command line parser from a configuration,
+        returns the parser and (argument, argparse destination, keys path)
+        tuples
+    """
+    parser = _ConfParser()
+    parser._positionals.title = "Configuration file"
+    parser._optionals.title = "Options"
+    parser.add_argument(
+        "conf_file",
+        help="Path to YAML configuration file (optional)",
+        type=argparse.FileType("rb"),
+        nargs="?",
+    )
+
+    arg_paths = []
+    specs = []
+
+    for arg, path, val, pargs in _conf_options(conf):
+        log.debug(
+            "building argparse for arg:%s val:%s type:%s", arg, val, type(val).__name__
+        )
+
+        pkwargs, helpmsg = _ACTION_TABLE.get(type(val), _store_cfg)(
+            val, arg, mandatory_opts
+        )
+        pkwargs["help"] = helpmsg
+        # Workaround dashes being replaced by underscore in argparse
+        pkwargs["dest"] = arg.replace("-", "_")
+
+        log.debug(" argparse parameters: %s, %s", pargs, pkwargs)
+        specs.append((pargs, pkwargs))
+        arg_paths.append((arg, pkwargs["dest"], path))
+
+    parser._bulk_add(specs)
+    return parser, arg_paths
 
 
 def pyonf(default_conf={}, mandatory_opts=[], argv=None, as_global_vars=False):
@@ -117,7 +333,7 @@ def pyonf(default_conf={}, mandatory_opts=[], argv=None, as_global_vars=False):
         if os.path.isfile(default_conf):
             try:
                 log.debug(" open as YAML file")
-                conf = yaml.safe_load(open(default_conf))
+                conf = _load_conf_file(default_conf)
             except Exception as ex:
                 print(
                     "pyonf: Cannot parse 'default_conf' argument:\n"
@@ -127,7 +343,7 @@ def pyonf(default_conf={}, mandatory_opts=[], argv=None, as_global_vars=False):
                 sys.exit(1)
         else:
             try:
-                conf = yaml.safe_load(default_conf)
+                conf = _intern_keys(_yaml_load(default_conf))
             except Exception as ex:
                 log.debug(" open as YAML string")
                 print(
@@ -157,98 +373,73 @@ def pyonf(default_conf={}, mandatory_opts=[], argv=None, as_global_vars=False):
         )
         sys.exit(1)
 
-    parser = argparse.ArgumentParser()
-    parser._positionals.title = "Configuration file"
-    parser._optionals.title = "Options"
-    parser.add_argument(
-        "conf_file",
-        help="Path to YAML configuration file (optional)",
-        type=argparse.FileType("r"),
-        nargs="?",
-    )
-
-    # We must replace "-" by "_" in keys
-    conf = _deep_key_replace(conf, "-", "_")
-    log.debug(" content: %s" % conf)
-
-    short_args = set()
-    argvals = sorted(_dict_to_args(conf))
-
-    for arg, val in argvals:
-        log.debug(
-            "building argparse for arg:%s val:%s type:%s", arg, val, type(val).__name__
-        )
-
-        pargs = ["--" + arg]
-        if not arg[0] in short_args:
-            pargs.append("-" + arg[0])
-            short_args.add(arg[0])
-
-        pkwargs = {}
-
-        if isinstance(val, bool) and not val:
-            pkwargs["action"] = "store_true"
-        elif isinstance(val, bool) and val:
-            pkwargs["action"] = "store_false"
-        elif isinstance(val, list):
-            pkwargs["action"] = ListAction
-        else:
-            pkwargs["action"] = "store"
-
-        if not isinstance(val, bool):
-            if val is not None and not isinstance(val, list):
-                pkwargs["type"] = type(val)
-            else:
-                pkwargs["type"] = str
+    # We must replace "-" by "_" in keys. Parsed YAML is ours to modify
+    # as is, but a default_conf dict must be copied anyway
+    if not isinstance(default_conf, str) or _deep_key_find(conf, "-"):
+        conf = _deep_key_replace(conf, "-", "_")
+    log.debug(" content: %s", conf)
 
-        if isinstance(val, (tuple, list)):
-            pkwargs["metavar"] = "%s,%s,..." % (arg.upper()[0], arg.upper()[0])
+    conf_data = None
+    skip_argparse = not argv or (
+        len(argv) == 1 and not argv[0].startswith("-") and os.path.isfile(argv[0])
+    )
+    if skip_argparse:
+        # Without argparse, still fail on a default config argparse rejects
+        options = _conf_options(conf)
+        _check_options(options)
+        # and give options the values argparse would give them by default:
+        # only store_false (i.e. True booleans) ones are set
+        cli_values = [
+            (arg, path, True) for arg, path, val, pargs in options if val is True
+        ]
 
-        helpmsg = "*mandatory*, " if arg in mandatory_opts else ""
-        if isinstance(val, (tuple, list)):
-            helpmsg += 'set elements of "%s" list, separated by ","' % arg
-        elif isinstance(val, bool):
-            helpmsg += 'turn %s "%s"' % ("on" if not val else "off", arg)
-        else:
-            helpmsg += 'set "%s" value, as %s' % (arg, pkwargs["type"].__name__)
+    if not argv:
+        log.debug("no command line arguments, skipping argparse")
+    elif skip_argparse:
+        log.debug("configuration file as only argument, skipping argparse")
+        try:
+            with open(argv[0], "rb") as conf_file:
+                conf_data = conf_file.read()
+        except (IOError, OSError) as ex:
+            print("pyonf: can't open '%s': %s" % (argv[0], ex), file=sys.stderr)
+            sys.exit(2)
+    else:
+        parser, arg_paths = _build_parser(conf, mandatory_opts)
+
+        log.debug("parsing command line")
+        cli_args = parser.parse_args(argv)
+        cli_values = [
+            (arg, path, getattr(cli_args, dest, None)) for arg, dest, path in arg_paths
+        ]
+        conf_file = cli_args.conf_file
+        if conf_file:
+            conf_data = conf_file.read()
+            # "-" gives stdin, which is not ours to close
+            if conf_file not in (sys.stdin, getattr(sys.stdin, "buffer", None)):
+                conf_file.close()
+
+    if conf_data is not None:
+        file_conf = _intern_keys(_yaml_load(conf_data))
+        log.debug(" config from provided file is: %s", file_conf)
+
+    file_keys = set()
+    conf = _deep_update(conf, file_conf, track=file_keys)
+
+    # Command line values take precedence, set them in place
+    for arg, path, val in cli_values:
         if val:
-            helpmsg += " (%s %s)" % (
-                "e.g.," if arg in mandatory_opts else "default is",
-                val,
-            )
-        pkwargs["help"] = helpmsg
-
-        log.debug(" argparse parameters: %s, %s", pargs, pkwargs)
-        parser.add_argument(*pargs, **pkwargs)
-
-    log.debug("parsing command line")
-
-    available_args = [arg for arg, val in argvals]
-    cli_args = parser.parse_args(argv)
-
-    # Workaround dashes being replaced by underscore in argparse
-    cli_conf = {
-        arg: getattr(cli_args, arg.replace("-", "_"))
-        for arg in available_args
-        if hasattr(cli_args, arg.replace("-", "_"))
-        and getattr(cli_args, arg.replace("-", "_"))
-    }
-    cli_conf = _args_to_dict(cli_conf)
-
+            sub_dict_ptr = conf
+            for key in path[:-1]:
+                if not isinstance(sub_dict_ptr.get(key), dict):
+                    sub_dict_ptr[key] = {}
+                sub_dict_ptr = sub_dict_ptr[key]
+            sub_dict_ptr[path[-1]] = val
+            cli_conf[arg] = val
     log.debug(" config from command line is: %s", cli_conf)
-
-    if cli_args.conf_file:
-        file_conf = yaml.safe_load(cli_args.conf_file)
-        log.debug(" config from provided file is: %s" % file_conf)
-
-    conf = _deep_update(conf, file_conf)
-    conf = _deep_update(conf, cli_conf)
     log.debug("full config is: %s", conf)
 
     for mopt in mandatory_opts:
-        if mopt not in [x for x, y in _dict_to_args(file_conf)] and mopt not in [
-            x for x, y in _dict_to_args(cli_conf)
-        ]:
+        if mopt not in file_keys and mopt not in cli_conf:
             print('Error: "%s" option is not set' % mopt, file=sys.stderr)
             sys.exit(1)
 
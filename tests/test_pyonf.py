@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pyonf import pyonf
+
+
+class TestSkippedArgparse(unittest.TestCase):
+    """
+        Without options on the command line, argparse is not used:
+        results must be the same as if it was
+    """
+
+    default_conf = {"verbose": True, "n": 1}
+
+    def setUp(self):
+        self.argv = sys.argv
+        sys.argv = ["prog"]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.conf_path = os.path.join(self.tmp_dir, "conf.yml")
+        with open(self.conf_path, "w") as conf_file:
+            conf_file.write("n: 5\n")
+
+    def tearDown(self):
+        sys.argv = self.argv
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_argv(self):
+        conf = pyonf(self.default_conf, mandatory_opts=["verbose"])
+        self.assertEqual(conf, {"verbose": True, "n": 1})
+
+    def test_no_argv_missing_mandatory(self):
+        with self.assertRaises(SystemExit):
+            pyonf(self.default_conf, mandatory_opts=["n"])
+
+    def test_conf_file_only(self):
+        conf = pyonf(
+            self.default_conf, mandatory_opts=["verbose", "n"], argv=[self.conf_path]
+        )
+        self.assertEqual(conf, {"verbose": True, "n": 5})
+
+    def test_same_as_argparse(self):
+        argv = [self.conf_path, "-n", "5"]
+        self.assertEqual(
+            pyonf(self.default_conf, mandatory_opts=["verbose"], argv=argv),
+            pyonf(self.default_conf, mandatory_opts=["verbose"], argv=argv[:1]),
+        )
+
+
+class TestConfFileCache(unittest.TestCase):
+    """
+        A cached default_conf file must not be served for another file
+    """
+
+    def setUp(self):
+        self.argv = sys.argv
+        sys.argv = ["prog"]
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        for name, user in (("d1", "aaa"), ("d2", "bbb")):
+            os.mkdir(os.path.join(self.tmp_dir, name))
+            path = os.path.join(self.tmp_dir, name, "c.yml")
+            with open(path, "w") as conf_file:
+                conf_file.write("user: %s\n" % user)
+            os.utime(path, (0, 0))
+
+    def tearDown(self):
+        sys.argv = self.argv
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_relative_path_after_chdir(self):
+        for name, user in (("d1", "aaa"), ("d2", "bbb")):
+            os.chdir(os.path.join(self.tmp_dir, name))
+            self.assertEqual(pyonf("c.yml"), {"user": user})
+
+
+if __name__ == "__main__":
+    unittest.main()